@@ -5,6 +5,7 @@ from pydantic import BaseModel
 from google import genai
 import json
 import os
+import functools
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -28,6 +29,20 @@ def get_query_rewriter_agent() -> Agent:
     )
 
 
+@functools.lru_cache(maxsize=4096)
+def rewrite_query(query: str) -> str:
+    """
+    Rewrite a query for retrieval, memoized per query text.
+    
+    Args:
+        query (str): The user's query
+        
+    Returns:
+        str: The rewritten query
+    """
+    return get_query_rewriter_agent().run(query).content
+
+
 def get_rag_agent() -> Agent:
     """Initialize the main RAG agent."""
     return Agent(
@@ -80,12 +95,24 @@ def generate_session_title(query: str) -> str:
         str: A concise 4-5 word title
     """
     try:
-        title_agent = get_session_title_generator()
-        title = title_agent.run(f"Generate a concise 4-5 word title for this query: {query}").content
-        return title.strip()
+        return _generate_session_title(query)
     except Exception as e:
         return "Untitled Session"
 
+@functools.lru_cache(maxsize=4096)
+def _generate_session_title(query: str) -> str:
+    # Failures raise and are therefore never cached
+    title_agent = get_session_title_generator()
+    title = title_agent.run(f"Generate a concise 4-5 word title for this query: {query}").content
+    return title.strip()
+
+def get_llm_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the memoized agent calls"""
+    return {
+        "query_rewriter": rewrite_query.cache_info()._asdict(),
+        "session_title": _generate_session_title.cache_info()._asdict()
+    }
+
 client = genai.Client(api_key=os.getenv("GEMINI_API_KEY", ""))
 
 class UrldetectionResult(BaseModel):
@@ -1,19 +1,31 @@
 import google.generativeai as genai
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Any
 from pinecone import Pinecone, ServerlessSpec
 from langchain_pinecone import PineconeVectorStore
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
+import numpy as np
 import os
+import uuid
 import logging
 
+try:
+    import simsimd
+except ImportError:  # SIMD kernels are optional, NumPy is used as a fallback
+    simsimd = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Constants
 INDEX_NAME = "gemini-thinking-agent-agno"
+LOCAL_INDEX_NAME = "bge-thinking-agent-agno"  # Local embeddings live in their own vector space
 EMBEDDING_DIMENSION = 768  # Gemini embedding-004 dimension
+UPSERT_BATCH_SIZE = 100  # Vectors per Pinecone upsert request
+LOCAL_EMBEDDING_MODEL = "BAAI/bge-base-en-v1.5"  # 768 dimensions, same as Gemini
+LOCAL_EMBEDDING_BATCH_SIZE = 256  # Chunks per GPU forward pass
+BGE_QUERY_INSTRUCTION = "Represent this sentence for searching relevant passages: "
 
 class GeminiEmbedder(Embeddings):
     def __init__(self, model_name="models/text-embedding-004", api_key=None):
@@ -23,7 +35,15 @@ class GeminiEmbedder(Embeddings):
         self.model = model_name
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return [self.embed_query(text) for text in texts]
+        if not texts:
+            return []
+        # A list of contents is sent as batched embedding requests
+        response = genai.embed_content(
+            model=self.model,
+            content=list(texts),
+            task_type="retrieval_document"
+        )
+        return response['embedding']
 
     def embed_query(self, text: str) -> List[float]:
         response = genai.embed_content(
@@ -34,7 +54,124 @@ class GeminiEmbedder(Embeddings):
         return response['embedding']
 
 
-def init_pinecone(api_key=None):
+class LocalEmbedder(Embeddings):
+    """
+    On-premise embeddings from a sentence-transformers model on the local GPU.
+
+    bge-base-en-v1.5 produces 768-dimensional vectors like Gemini, but the
+    two vector spaces are not compatible, so its vectors are stored in
+    LOCAL_INDEX_NAME (see index_name_for).
+    """
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, device=None, batch_size=LOCAL_EMBEDDING_BATCH_SIZE):
+        # Heavy optional dependencies, only needed when EMBEDDING_BACKEND=local
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device=self.device)
+        if self.device.startswith("cuda"):
+            # fp16 halves memory traffic with no measurable retrieval loss
+            self.model.half()
+        self.model.eval()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        with self.torch.inference_mode():
+            return self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Batch chunks of similar length together so little compute goes to padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float16)
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            vectors[rows] = self._encode([texts[i] for i in rows])
+        # Pinecone and langchain expect plain float lists
+        return vectors.astype(np.float32).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # bge models are trained with an instruction prefix on queries
+        vector = self._encode([BGE_QUERY_INSTRUCTION + text])[0]
+        return vector.astype(np.float32).tolist()
+
+
+def index_name_for(backend: str = "gemini") -> str:
+    """
+    Pinecone index holding the vectors of an embedding backend
+
+    Gemini and bge vectors have the same dimension but are not comparable,
+    so each backend gets its own index and can never query the other's.
+    """
+    return LOCAL_INDEX_NAME if backend == "local" else INDEX_NAME
+
+
+def create_embedder(backend: str = "gemini", api_key=None) -> Embeddings:
+    """
+    Create the embedder for the configured backend
+
+    Args:
+        backend: "gemini" for the Gemini API or "local" for a sentence-transformers model
+        api_key: Gemini API key, unused by the local backend
+    """
+    if backend == "local":
+        return LocalEmbedder()
+    if backend != "gemini":
+        logger.warning(f"Unknown embedding backend '{backend}', using gemini")
+    return GeminiEmbedder(api_key=api_key)
+
+
+def normalize_embedding(vector) -> np.ndarray:
+    """L2-normalize an embedding (or a batch of embeddings) as float32."""
+    arr = np.asarray(vector, dtype=np.float32)
+    norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+def quantize_embedding(vector) -> np.ndarray:
+    """
+    Symmetric int8 quantization of an embedding (or a batch of embeddings).
+    
+    Each vector is scaled by its own max magnitude, which cosine similarity
+    is invariant to, so only rounding error affects scores.
+    """
+    arr = np.asarray(vector, dtype=np.float32)
+    max_abs = np.abs(arr).max(axis=-1, keepdims=True)
+    max_abs[max_abs == 0] = 1.0
+    return np.round(arr / max_abs * 127).astype(np.int8)
+
+
+def cosine_similarities(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity between a query vector and every row of a matrix.
+    
+    Float inputs are expected to be L2-normalized; int8 inputs may have any
+    scale. The query is cast to the matrix dtype, so float16 and int8
+    matrices are scored with the matching low-precision kernels. Uses SimSIMD
+    batched kernels when available, NumPy otherwise.
+    """
+    if len(matrix) == 0:
+        return np.empty(0, dtype=np.float32)
+    if simsimd is not None:
+        query = query.astype(matrix.dtype)
+        distances = np.asarray(simsimd.cdist(query[np.newaxis, :], matrix, metric="cosine"))
+        return 1.0 - distances.reshape(-1)
+    if np.issubdtype(matrix.dtype, np.integer):
+        return normalize_embedding(matrix) @ normalize_embedding(query)
+    return matrix.astype(np.float32) @ query.astype(np.float32)
+
+
+def init_pinecone(api_key=None, index_name: str = INDEX_NAME):
     """Initialize Pinecone client with configured settings."""
     # Use provided API key or get from environment
     api_key = api_key or os.getenv("PINECONE_API_KEY", "")
@@ -47,14 +184,14 @@ def init_pinecone(api_key=None):
         # Check if index exists, create if not
         existing_indexes = [index.name for index in pc.list_indexes()]
         
-        if INDEX_NAME not in existing_indexes:
+        if index_name not in existing_indexes:
             pc.create_index(
-                name=INDEX_NAME,
+                name=index_name,
                 dimension=EMBEDDING_DIMENSION,
                 metric="cosine",
                 spec=ServerlessSpec(cloud="aws", region="us-east-1")
             )
-            logger.info(f"Created new index: {INDEX_NAME}")
+            logger.info(f"Created new index: {index_name}")
             
         return pc
     except Exception as e:
@@ -62,7 +199,8 @@ def init_pinecone(api_key=None):
         return None
 
 
-def create_vector_store(pc_client, texts, namespace: Optional[str] = None, curriculum_id: Optional[str] = None):
+def create_vector_store(pc_client, texts, namespace: Optional[str] = None, curriculum_id: Optional[str] = None,
+                        index=None, embedding: Optional[Embeddings] = None):
     """
     Create and initialize vector store with documents.
     
@@ -71,10 +209,12 @@ def create_vector_store(pc_client, texts, namespace: Optional[str] = None, curri
         texts: Documents to add to the vector store
         namespace: Optional namespace for isolating chat session data
         curriculum_id: Optional curriculum ID to use as namespace
+        index: Optional shared Pinecone index handle to reuse
+        embedding: Optional shared embedder to reuse
     """
     try:
         # Initialize vector store
-        index = pc_client.Index(INDEX_NAME)
+        index = index or pc_client.Index(INDEX_NAME)
         
         # Use curriculum_id as namespace if provided (takes precedence)
         if curriculum_id:
@@ -82,14 +222,14 @@ def create_vector_store(pc_client, texts, namespace: Optional[str] = None, curri
             
         vector_store = PineconeVectorStore(
             index=index,
-            embedding=GeminiEmbedder(),
+            embedding=embedding or GeminiEmbedder(),
             text_key="text",
             namespace=namespace
         )
         
         # Add documents
         logger.info('Uploading documents to Pinecone...')
-        vector_store.add_documents(texts)
+        vector_store.add_documents(texts, batch_size=UPSERT_BATCH_SIZE)
         ns_msg = f" in namespace '{namespace}'" if namespace else ""
         logger.info(f"Documents stored successfully{ns_msg}")
         return vector_store
@@ -99,7 +239,56 @@ def create_vector_store(pc_client, texts, namespace: Optional[str] = None, curri
         return None
 
 
-def check_document_relevance(query: str, vector_store, threshold: float = 0.7, namespace: Optional[str] = None, curriculum_id: Optional[str] = None) -> Tuple[bool, List[Document]]:
+def namespace_vector_count(index, namespace: str) -> int:
+    """Number of vectors Pinecone currently holds in a namespace."""
+    stats = index.describe_index_stats()
+    summary = stats.namespaces.get(namespace)
+    return summary.vector_count if summary else 0
+
+
+def upsert_documents(index, embedding: Embeddings, texts: List[Document], namespace: str, local_cache=None, text_key: str = "text") -> Tuple[List[str], List[List[float]]]:
+    """
+    Embed documents in one batch and upsert them into a Pinecone namespace.
+    
+    Args:
+        index: Pinecone index handle
+        embedding: Embedder used for the documents
+        texts: Documents to add
+        namespace: Namespace to add the documents to
+        local_cache: Optional LocalVectorCache that mirrors the embeddings
+        text_key: Metadata key holding the document text
+        
+    Returns:
+        Tuple[List[str], List[List[float]]]: (vector_ids, embeddings)
+    """
+    # A namespace can only be served locally if we have seen every vector in it
+    if local_cache is not None and local_cache.enabled and not local_cache.is_known(namespace):
+        local_cache.start_tracking(namespace, complete=namespace_vector_count(index, namespace) == 0)
+    
+    try:
+        embeddings = embedding.embed_documents([doc.page_content for doc in texts])
+        ids = [str(uuid.uuid4()) for _ in texts]
+        vectors = []
+        for doc_id, doc, values in zip(ids, texts, embeddings):
+            metadata = dict(doc.metadata)
+            metadata[text_key] = doc.page_content
+            vectors.append((doc_id, values, metadata))
+        
+        for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            index.upsert(vectors=vectors[start:start + UPSERT_BATCH_SIZE], namespace=namespace)
+        
+        if local_cache is not None:
+            local_cache.add(namespace, embeddings, texts)
+    except Exception:
+        # Batches already upserted stay in Pinecone, so the local copy can no longer be complete
+        if local_cache is not None:
+            local_cache.mark_incomplete(namespace)
+        raise
+    return ids, embeddings
+
+
+def check_document_relevance(query: str, vector_store, threshold: float = 0.7, namespace: Optional[str] = None, curriculum_id: Optional[str] = None,
+                             query_embedding: Optional[List[float]] = None, local_cache=None, with_scores: bool = False) -> Tuple[bool, List[Any]]:
     """
     Check if documents in vector store are relevant to the query.
     
@@ -109,6 +298,9 @@ def check_document_relevance(query: str, vector_store, threshold: float = 0.7, n
         threshold: Similarity threshold
         namespace: Optional namespace to search within
         curriculum_id: Optional curriculum ID to use as namespace
+        query_embedding: Optional precomputed embedding of the query
+        local_cache: Optional LocalVectorCache to score against before querying Pinecone
+        with_scores: Return (document, relevance) pairs instead of documents
         
     Returns:
         tuple[bool, List]: (has_relevant_docs, relevant_docs)
@@ -123,6 +315,27 @@ def check_document_relevance(query: str, vector_store, threshold: float = 0.7, n
     # Set the namespace if provided and not already set in vector_store
     if namespace and not getattr(vector_store, 'namespace', None):
         vector_store.namespace = namespace
+    
+    # Score locally when this process holds a complete copy of the namespace
+    if local_cache is not None and namespace and local_cache.is_complete(namespace):
+        if query_embedding is None:
+            query_embedding = vector_store.embeddings.embed_query(query)
+        docs = local_cache.search(namespace, query_embedding, k=5, threshold=threshold, with_scores=with_scores)
+        return bool(docs), docs
+    
+    if query_embedding is not None:
+        results = vector_store.similarity_search_by_vector_with_score(query_embedding, k=5, namespace=namespace)
+        # Same relevance scale as the retriever: cosine similarity mapped to [0, 1]
+        scored = [(doc, (score + 1) / 2) for doc, score in results]
+        docs = [(doc, relevance) if with_scores else doc for doc, relevance in scored if relevance >= threshold]
+        return bool(docs), docs
+    
+    if with_scores:
+        # What the threshold retriever runs underneath, keeping the scores
+        docs = vector_store.similarity_search_with_relevance_scores(
+            query, k=5, score_threshold=threshold, namespace=namespace
+        )
+        return bool(docs), docs
         
     retriever = vector_store.as_retriever(
         search_type="similarity_score_threshold",
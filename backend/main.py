@@ -1,14 +1,19 @@
 import os
 import json
-import tempfile
+import asyncio
 import uuid
+import time
 import importlib
-from typing import List, Optional, Dict, Any
+import aiofiles.tempfile
+import orjson
+import msgspec
+from typing import List, Optional, Dict, Any, Type, TypeVar, Annotated
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks, Query, Header, Security
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks, Query, Header, Security, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, ORJSONResponse, Response
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel
 from contextlib import asynccontextmanager
 import google.generativeai as genai
 import sys
@@ -31,7 +36,9 @@ from embedder import (
     init_pinecone,
     create_vector_store,
     check_document_relevance,
-    GeminiEmbedder
+    upsert_documents,
+    create_embedder,
+    index_name_for
 )
 from langchain_pinecone import PineconeVectorStore
 
@@ -41,11 +48,13 @@ from search import google_search
 from document_loader import prepare_document, process_pdf, process_web, process_image
 
 # Import agents using direct imports
-from agents.writeragents import get_query_rewriter_agent, get_rag_agent, test_url_detector, generate_session_title
+from agents.writeragents import rewrite_query, get_rag_agent, generate_session_title, get_llm_cache_stats
 
 # Import session management functions
 from utils.session_manager import (
     save_session,
+    append_turn,
+    detect_message_log,
     load_session,
     get_available_sessions,
     delete_session,
@@ -55,6 +64,11 @@ from utils.session_manager import (
 # Import supabase client
 from utils.supabase_client import initialize_supabase
 
+from utils.formaturl import detect_urls
+from utils.semantic_cache import SemanticCache
+from utils.vector_cache import LocalVectorCache
+from utils.session_registry import SessionStoreRegistry
+
 from agents.intentdetectorAgent import detect_google_search_intent
 
 # Import curriculum service
@@ -96,17 +110,33 @@ GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY", "")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "")
 API_KEY = os.getenv("API_KEY", "")  # Remove default value to make authentication optional
 API_AUTH_REQUIRED = os.getenv("API_AUTH_REQUIRED", "false").lower() == "true"  # Default to not requiring auth
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini").lower()  # "gemini" or "local" (sentence-transformers on GPU)
+PINECONE_INDEX_NAME = index_name_for(EMBEDDING_BACKEND)  # One index per embedding backend
+# The local vector copy only sees this process's upserts, so it is only safe with a single worker
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+LOCAL_VECTOR_CACHE_ENABLED = os.getenv("LOCAL_VECTOR_CACHE", "true").lower() == "true" and WEB_CONCURRENCY <= 1
 
 # Hardcoded similarity threshold
 SIMILARITY_THRESHOLD = 0.7
+# Document relevance at which a concurrent Google search is abandoned
+HIGH_CONFIDENCE_THRESHOLD = 0.85
+
+# Rewritten queries at least this similar to a cached one reuse its response
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX_ENTRIES = 10000
 
 # Initialize app state
 app_state = {
     "vector_store": None,
     "processed_documents": [],
     "pinecone_client": None,
+    "pinecone_index": None,
+    "embedder": None,
     "supabase_client": None,
-    "session_vector_stores": {}
+    "session_vector_stores": SessionStoreRegistry(),
+    "semantic_cache": SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES),
+    "vector_cache": LocalVectorCache(enabled=LOCAL_VECTOR_CACHE_ENABLED),
+    "health_snapshot": None
 }
 
 # Setup security
@@ -132,21 +162,32 @@ async def lifespan(app: FastAPI):
     # Initialize on startup
     os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
     genai.configure(api_key=GOOGLE_API_KEY)
-    app_state["pinecone_client"] = init_pinecone(PINECONE_API_KEY)
+    app_state["pinecone_client"] = init_pinecone(PINECONE_API_KEY, index_name=PINECONE_INDEX_NAME)
+    # Long-lived clients shared by every request
+    app_state["embedder"] = create_embedder(EMBEDDING_BACKEND, api_key=GOOGLE_API_KEY)
+    if app_state["pinecone_client"]:
+        app_state["pinecone_index"] = app_state["pinecone_client"].Index(PINECONE_INDEX_NAME)
     app_state["supabase_client"] = initialize_supabase()
+    detect_message_log()
+    app_state["health_snapshot"] = None
     
     yield
     
     # Clean up on shutdown
     app_state["vector_store"] = None
     app_state["processed_documents"] = []
-    app_state["session_vector_stores"] = {}
+    app_state["session_vector_stores"].clear()
+    app_state["semantic_cache"].clear()
+    app_state["vector_cache"].clear()
+    app_state["pinecone_index"] = None
+    app_state["embedder"] = None
 
 app = FastAPI(
     title="Teacher Assistant API", 
     description="API for teacher assistant with RAG capabilities",
     lifespan=lifespan,
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Enable CORS
@@ -158,21 +199,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Pydantic models for requests and responses
-class MessageRequest(BaseModel):
+# msgspec structs for the hot request bodies, decoded in compiled code
+class MessageRequest(msgspec.Struct):
     content: str
     force_web_search: bool = False
     session_id: Optional[str] = None
 
+class ProcessUrlRequest(msgspec.Struct):
+    url: Annotated[str, msgspec.Meta(pattern=r"^[Hh][Tt][Tt][Pp][Ss]?://[^\s/$.?#][^\s]*$")]
+    session_id: Optional[str] = None
+
+class CreateSessionRequest(msgspec.Struct):
+    session_name: Optional[str] = None
+
+StructT = TypeVar("StructT", bound=msgspec.Struct)
+
+async def decode_body(http_request: Request, struct_type: Type[StructT], allow_empty: bool = False) -> StructT:
+    """
+    Decode and validate a JSON request body into a msgspec struct
+    
+    With allow_empty, a missing body or a JSON null yields the struct defaults.
+    
+    Raises:
+        HTTPException: 422 if the body is not valid JSON for the struct
+    """
+    body = await http_request.body()
+    if not body and allow_empty:
+        return struct_type()
+    try:
+        if allow_empty:
+            return msgspec.json.decode(body, type=Optional[struct_type]) or struct_type()
+        return msgspec.json.decode(body, type=struct_type)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def body_schema(struct_type: Type[msgspec.Struct], required: bool = True) -> Dict[str, Any]:
+    """OpenAPI requestBody for an endpoint that decodes its body with decode_body"""
+    _, components = msgspec.json.schema_components([struct_type])
+    return {
+        "requestBody": {
+            "required": required,
+            "content": {"application/json": {"schema": components[struct_type.__name__]}}
+        }
+    }
+
+# Pydantic models for responses
+
 class MessageResponse(BaseModel):
     content: str
     sources: List[Dict[str, str]] = []
     session_id: str
 
-class ProcessUrlRequest(BaseModel):
-    url: HttpUrl
-    session_id: Optional[str] = None
-
 class ProcessResponse(BaseModel):
     success: bool
     sources: List[str] = []
@@ -197,9 +274,6 @@ class SessionResponse(BaseModel):
     processed_documents: List[str] = []
     use_web_search: bool = False
 
-class CreateSessionRequest(BaseModel):
-    session_name: Optional[str] = None
-
 class CreateSessionResponse(BaseModel):
     session_id: str
     session_name: str
@@ -216,32 +290,29 @@ performance_metrics = {
 
 # Helper function to get or create session vector store with caching and performance tracking
 def get_session_vector_store(session_id: str):
-    import time
-    start_time = time.time()
+    vector_store = app_state["session_vector_stores"].get(session_id)
+    if vector_store:
+        return vector_store
     
-    if session_id in app_state["session_vector_stores"]:
-        return app_state["session_vector_stores"][session_id]
-    
-    if app_state["pinecone_client"]:
+    start_time = time.time()
+    if app_state["pinecone_index"]:
         try:
             # Check if we have too many namespaces already (Pinecone can have limits)
             if len(app_state["session_vector_stores"]) > 100:  # Adjust this threshold as needed
                 # Remove least recently used vector stores to prevent namespace explosion
-                # This is a simple implementation - consider a more sophisticated LRU cache
-                oldest_sessions = sorted(app_state["session_vector_stores"].keys())[:10]
+                oldest_sessions = app_state["session_vector_stores"].evict_least_recently_used(10)
                 for old_session in oldest_sessions:
-                    del app_state["session_vector_stores"][old_session]
+                    app_state["vector_cache"].drop(old_session)
                 print(f"Cleaned up {len(oldest_sessions)} old vector store sessions")
             
-            index = app_state["pinecone_client"].Index("gemini-thinking-agent-agno")
-            from embedder import GeminiEmbedder
+            # Only bind the namespace; the index handle and embedder are shared
             vector_store = PineconeVectorStore(
-                index=index,
-                embedding=GeminiEmbedder(api_key=GOOGLE_API_KEY),
+                index=app_state["pinecone_index"],
+                embedding=app_state["embedder"],
                 text_key="text",
                 namespace=session_id
             )
-            app_state["session_vector_stores"][session_id] = vector_store
+            app_state["session_vector_stores"].put(session_id, vector_store)
             
             # Track performance metric
             creation_time = time.time() - start_time
@@ -260,18 +331,41 @@ def get_session_vector_store(session_id: str):
 async def root():
     return {"message": "Teacher Assistant API is running"}
 
-@app.get("/health")
-async def health_check():
+def get_health_status() -> Dict[str, Any]:
     return {
         "status": "healthy", 
         "google_api_key": bool(GOOGLE_API_KEY),
         "pinecone_api_key": bool(PINECONE_API_KEY),
         "pinecone_client": bool(app_state["pinecone_client"]),
         "supabase_client": bool(app_state["supabase_client"]),
+        "shared_clients": {
+            "pinecone_index": bool(app_state["pinecone_index"]),
+            "embedder": bool(app_state["embedder"])
+        },
         "documents_processed": len(app_state["processed_documents"]),
         "sessions_active": len(app_state["session_vector_stores"])
     }
 
+@app.get("/health")
+async def health_check():
+    # Serve a pre-serialized payload, rebuilt only when the session registry changes
+    version = app_state["session_vector_stores"].version
+    snapshot = app_state["health_snapshot"]
+    if snapshot is None or snapshot[0] != version:
+        snapshot = (version, orjson.dumps(get_health_status()))
+        app_state["health_snapshot"] = snapshot
+    return Response(content=snapshot[1], media_type="application/json")
+
+@app.get("/health/details")
+async def health_details():
+    """Health status plus live cache and batching statistics"""
+    return {
+        **get_health_status(),
+        "semantic_cache": app_state["semantic_cache"].get_stats(),
+        "vector_cache": app_state["vector_cache"].get_stats(),
+        "llm_caches": get_llm_cache_stats()
+    }
+
 # SESSION MANAGEMENT ENDPOINTS
 @app.get("/sessions", response_model=SessionListResponse, dependencies=[Depends(get_api_key)])
 async def get_sessions():
@@ -285,13 +379,19 @@ async def get_sessions():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
-@app.post("/sessions", response_model=CreateSessionResponse, dependencies=[Depends(get_api_key)])
-async def create_session(request: CreateSessionRequest = None):
+@app.post(
+    "/sessions",
+    response_model=CreateSessionResponse,
+    dependencies=[Depends(get_api_key)],
+    openapi_extra=body_schema(CreateSessionRequest, required=False)
+)
+async def create_session(http_request: Request):
     """Create a new chat session"""
+    request = await decode_body(http_request, CreateSessionRequest, allow_empty=True)
     try:
         # Create new session with Supabase
         session_id = str(uuid.uuid4())
-        session_name = request.session_name if request and request.session_name else "Untitled Session"
+        session_name = request.session_name or "Untitled Session"
         
         # Initialize empty session data
         session_data = {
@@ -311,7 +411,7 @@ async def create_session(request: CreateSessionRequest = None):
         if not success:
             raise HTTPException(status_code=500, detail=f"Failed to create session: {error}")
         
-        return {"session_id": session_id, "session_name": session_name}
+        return ORJSONResponse({"session_id": session_id, "session_name": session_name})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating session: {str(e)}")
 
@@ -342,14 +442,144 @@ async def remove_session(session_id: str):
             raise HTTPException(status_code=500, detail=f"Failed to delete session: {error}")
         
         # Also clean up any vector stores
-        if session_id in app_state["session_vector_stores"]:
-            del app_state["session_vector_stores"][session_id]
+        app_state["session_vector_stores"].remove(session_id)
+        app_state["vector_cache"].drop(session_id)
+        app_state["semantic_cache"].invalidate(session_id)
         
         return {"success": True, "message": f"Session {session_id} deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 # DOCUMENT PROCESSING ENDPOINTS
+ALLOWED_EXTENSIONS = ['.pdf', '.png', '.jpg', '.jpeg', '.gif', '.webp']
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.webp']
+
+async def extract_upload_texts(file: UploadFile) -> List:
+    """
+    Validate an uploaded file and extract its text chunks
+    
+    Raises:
+        HTTPException: If the file is too large, unsupported or yields no content
+    """
+    file_name = file.filename
+    
+    # Check file type based on extension
+    file_ext = os.path.splitext(file_name)[1].lower()
+    
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported file format: {file_ext}. Supported formats are: PDF, PNG, JPG, JPEG, GIF, WEBP"
+        )
+    
+    # Stream the upload to a temp file in 1 MB chunks, enforcing the 10 MB limit
+    file_size = 0
+    chunk_size = 1024 * 1024  # 1 MB
+    async with aiofiles.tempfile.NamedTemporaryFile("wb", delete=False, suffix=file_ext) as temp_file:
+        temp_path = temp_file.name
+        try:
+            while chunk := await file.read(chunk_size):
+                file_size += len(chunk)
+                
+                # Stop if file is too large (over 10MB)
+                if file_size > 10 * 1024 * 1024:
+                    raise HTTPException(
+                        status_code=413,
+                        detail="File too large, maximum size is 10 MB"
+                    )
+                await temp_file.write(chunk)
+        except Exception:
+            await temp_file.close()
+            os.unlink(temp_path)
+            raise
+    
+    # Process based on file type
+    doc_type = "Image" if file_ext in IMAGE_EXTENSIONS else "Document"
+    try:
+        if doc_type == "Image":
+            texts = await asyncio.to_thread(process_image, temp_path)
+        else:  # PDF or other document types
+            texts = await asyncio.to_thread(process_pdf, temp_path)
+            
+        # Ensure we got valid text chunks
+        if not texts or len(texts) == 0:
+            raise ValueError("No text content could be extracted from the file")
+            
+        print(f"Successfully processed {doc_type}: {file_name}, extracted {len(texts)} text chunks")
+        
+    except Exception as e:
+        print(f"Error processing {doc_type} content: {str(e)}")
+        raise HTTPException(
+            status_code=422, 
+            detail=f"Failed to process {doc_type.lower()} content: {str(e)}"
+        )
+    finally:
+        # Clean up temp file
+        os.unlink(temp_path)
+    
+    return texts
+
+async def ingest_texts(session_id: str, texts: List, source_ids: List[str], session_data: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Add text chunks to the session vector store and record their sources
+    
+    All chunks are embedded and upserted in one batch. The session is loaded
+    and saved at most once; when the caller passes session_data it is updated
+    in place and saving it is left to the caller.
+    
+    Returns:
+        List[str]: The session's processed documents after ingestion
+    """
+    caller_owns_session = session_data is not None
+    try:
+        # Get or create vector store for the session
+        vector_store = get_session_vector_store(session_id)
+        if not vector_store:
+            # Create new vector store with session namespace
+            vector_store = await asyncio.to_thread(
+                create_vector_store,
+                app_state["pinecone_client"], texts, namespace=session_id,
+                index=app_state["pinecone_index"], embedding=app_state["embedder"]
+            )
+            app_state["session_vector_stores"].put(session_id, vector_store)
+        else:
+            # Add to existing vector store
+            await asyncio.to_thread(
+                upsert_documents,
+                app_state["pinecone_index"], app_state["embedder"], texts,
+                namespace=session_id, local_cache=app_state["vector_cache"]
+            )
+        
+        # Cached answers for this session no longer reflect its documents
+        app_state["semantic_cache"].invalidate(session_id)
+        
+    except Exception as e:
+        print(f"Error adding to vector store: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to add document to vector store: {str(e)}"
+        )
+        
+    # Update session in database if it exists
+    if not caller_owns_session:
+        session_data, _ = await asyncio.to_thread(load_session, session_id)
+    
+    # Track processed documents in session, keeping first-seen order
+    processed_documents = list(session_data.get("processed_documents") or []) if session_data else []
+    known_documents = set(processed_documents)
+    for source_id in source_ids:
+        if source_id not in known_documents:
+            known_documents.add(source_id)
+            processed_documents.append(source_id)
+    
+    if session_data:
+        # Update session
+        session_data["processed_documents"] = processed_documents
+        if not caller_owns_session:
+            await asyncio.to_thread(save_session, session_id, session_data, include_history=False)
+    
+    return processed_documents
+
 @app.post("/process/document", response_model=ProcessResponse, dependencies=[Depends(get_api_key)])
 async def process_document(
     background_tasks: BackgroundTasks, 
@@ -364,103 +594,11 @@ async def process_document(
         session_id = str(uuid.uuid4())
     
     try:
-        # Check file size (10 MB limit)
-        file_size = 0
-        chunk_size = 1024 * 1024  # 1 MB
-        file_content = bytearray()
-        
-        while True:
-            chunk = await file.read(chunk_size)
-            if not chunk:
-                break
-            file_content.extend(chunk)
-            file_size += len(chunk)
-            
-            # Stop if file is too large (over 10MB)
-            if file_size > 10 * 1024 * 1024:
-                raise HTTPException(
-                    status_code=413,
-                    detail="File too large, maximum size is 10 MB"
-                )
-        
-        # Reset file position for reading again
-        await file.seek(0)
-        
-        # Check file type based on extension
-        file_ext = os.path.splitext(file_name)[1].lower()
-        allowed_extensions = ['.pdf', '.png', '.jpg', '.jpeg', '.gif', '.webp']
-        
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=415,
-                detail=f"Unsupported file format: {file_ext}. Supported formats are: PDF, PNG, JPG, JPEG, GIF, WEBP"
-            )
-        
-        # Save uploaded file to temp location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            temp_file.write(file_content)
-            temp_path = temp_file.name
-        
-        # Process based on file type
-        try:
-            if file_ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-                texts = process_image(temp_path)
-                doc_type = "Image"
-            else:  # PDF or other document types
-                texts = process_pdf(temp_path)
-                doc_type = "Document"
-                
-            # Ensure we got valid text chunks
-            if not texts or len(texts) == 0:
-                raise ValueError("No text content could be extracted from the file")
-                
-            print(f"Successfully processed {doc_type}: {file_name}, extracted {len(texts)} text chunks")
-            
-        except Exception as e:
-            print(f"Error processing {doc_type} content: {str(e)}")
-            os.unlink(temp_path)  # Clean up temp file
-            raise HTTPException(
-                status_code=422, 
-                detail=f"Failed to process {doc_type.lower()} content: {str(e)}"
-            )
-            
-        # Clean up temp file
-        os.unlink(temp_path)
+        texts = await extract_upload_texts(file)
         
         # Add to vector store
         if texts and app_state["pinecone_client"]:
-            try:
-                # Get or create vector store for the session
-                vector_store = get_session_vector_store(session_id)
-                if not vector_store:
-                    # Create new vector store with session namespace
-                    vector_store = create_vector_store(app_state["pinecone_client"], texts, namespace=session_id)
-                    app_state["session_vector_stores"][session_id] = vector_store
-                else:
-                    # Add to existing vector store
-                    vector_store.add_documents(texts)
-                
-            except Exception as e:
-                print(f"Error adding to vector store: {str(e)}")
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Failed to add document to vector store: {str(e)}"
-                )
-                
-            # Track processed document in session
-            processed_documents = [file_name]
-            
-            # Update session in database if it exists
-            session_data, _ = load_session(session_id)
-            if session_data:
-                # Append to existing documents if any
-                if "processed_documents" in session_data:
-                    processed_documents = list(set(session_data["processed_documents"] + [file_name]))
-                
-                # Update session
-                session_data["processed_documents"] = processed_documents
-                save_session(session_id, session_data)
-            
+            processed_documents = await ingest_texts(session_id, texts, [file_name])
             return {"success": True, "sources": processed_documents, "session_id": session_id}
         else:
             raise HTTPException(status_code=422, detail="No content could be extracted from the document")
@@ -474,42 +612,55 @@ async def process_document(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
-@app.post("/process/url", response_model=ProcessResponse, dependencies=[Depends(get_api_key)])
-async def process_url(request: ProcessUrlRequest):
+@app.post("/process/documents", response_model=ProcessResponse, dependencies=[Depends(get_api_key)])
+async def process_documents(
+    files: List[UploadFile] = File(...),
+    session_id: Optional[str] = Form(None)
+):
+    """Process several documents concurrently and add them to the vector store in one batch"""
+    # Generate session ID if not provided
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    
+    try:
+        results = await asyncio.gather(*(extract_upload_texts(file) for file in files))
+        all_texts = [text for texts in results for text in texts]
+        
+        # Add to vector store
+        if all_texts and app_state["pinecone_client"]:
+            processed_documents = await ingest_texts(session_id, all_texts, [file.filename for file in files])
+            return {"success": True, "sources": processed_documents, "session_id": session_id}
+        else:
+            raise HTTPException(status_code=422, detail="No content could be extracted from the documents")
+            
+    except HTTPException as e:
+        # Re-raise HTTP exceptions as they already have status_code and detail
+        raise e
+    except Exception as e:
+        print(f"Unexpected error processing documents: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
+
+@app.post(
+    "/process/url",
+    response_model=ProcessResponse,
+    dependencies=[Depends(get_api_key)],
+    openapi_extra=body_schema(ProcessUrlRequest)
+)
+async def process_url(http_request: Request):
     """Process a URL and add to vector store"""
-    web_url = str(request.url)
+    request = await decode_body(http_request, ProcessUrlRequest)
+    web_url = request.url
     
     # Generate session ID if not provided
     session_id = request.session_id or str(uuid.uuid4())
     
     try:
-        texts = process_web(web_url)
+        texts = await asyncio.to_thread(process_web, web_url)
         if texts and app_state["pinecone_client"]:
-            # Get or create vector store for the session
-            vector_store = get_session_vector_store(session_id)
-            if not vector_store:
-                # Create new vector store with session namespace
-                vector_store = create_vector_store(app_state["pinecone_client"], texts, namespace=session_id)
-                app_state["session_vector_stores"][session_id] = vector_store
-            else:
-                # Add to existing vector store
-                vector_store.add_documents(texts)
-            
-            # Track processed URL in session
-            processed_documents = [web_url]
-            
-            # Update session in database if it exists
-            session_data, _ = load_session(session_id)
-            if session_data:
-                # Append to existing documents if any
-                if "processed_documents" in session_data:
-                    processed_documents = list(set(session_data["processed_documents"] + [web_url]))
-                
-                # Update session
-                session_data["processed_documents"] = processed_documents
-                save_session(session_id, session_data)
-            
-            return {"success": True, "sources": processed_documents, "session_id": session_id}
+            processed_documents = await ingest_texts(session_id, texts, [web_url])
+            return ORJSONResponse({"success": True, "sources": processed_documents, "session_id": session_id})
         else:
             raise HTTPException(status_code=500, detail="Failed to process URL")
     except Exception as e:
@@ -528,204 +679,366 @@ async def get_session_sources(session_id: str):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 # CHAT ENDPOINTS
-@app.post("/chat", response_model=MessageResponse, dependencies=[Depends(get_api_key)])
-async def chat(request: MessageRequest):
+# Prompt pieces for the RAG agent, formatted once per turn
+PROMPT_TEMPLATE = "Context: {context}\n\nOriginal Question: {prompt}\nRewritten Question: {rewritten}\n\n"
+LINK_HEADER = "Source Links:\n"
+ANSWER_INSTRUCTION = "Please provide a comprehensive answer based on the available information."
+
+async def prepare_chat(request: MessageRequest) -> Dict[str, Any]:
     """
-    Process a chat message and return response
+    Run every step of a chat turn up to response generation
     
-    This endpoint handles:
-    1. Query rewriting automatically
-    2. Web search when force_web_search=true or when appropriate
-    3. Document retrieval from vector store
-    4. Response generation with all available context
+    Returns a turn dict holding the session data, the RAG prompt and the
+    response sources. When the semantic cache already answers the query,
+    "cached_response" is set and no prompt is built.
     """
     prompt = request.content
     force_web_search = request.force_web_search
     session_id = request.session_id or str(uuid.uuid4())
     
-    # Process and respond to the message
-    try:
-        # Load or initialize session data
-        session_data = None
-        if session_id:
-            session_data, _ = load_session(session_id)
-        
-        if not session_data:
-            session_data = {
-                "session_id": session_id,
-                "session_name": "Untitled Session",
-                "history": [],
-                "processed_documents": [],
-                "info_messages": [],
-                "rewritten_query": {"original": "", "rewritten": ""},
-                "search_sources": [],
-                "doc_sources": [],
-                "use_web_search": True
-            }
-        
-        # Add user message to history
-        history = session_data.get("history", [])
-        history.append({"role": "user", "content": prompt})
-        session_data["history"] = history
-        
-        # Check for URLs in prompt
-        url_detector = test_url_detector(prompt)
-        detected_urls = url_detector.urls
-        
-        # Process any detected URLs
-        for url in detected_urls:
-            if url not in session_data.get("processed_documents", []):
-                texts = process_web(url)
-                if texts and app_state["pinecone_client"]:
-                    # Get or create vector store for the session
-                    vector_store = get_session_vector_store(session_id)
-                    if not vector_store:
-                        # Create new vector store with session namespace
-                        vector_store = create_vector_store(app_state["pinecone_client"], texts, namespace=session_id)
-                        app_state["session_vector_stores"][session_id] = vector_store
-                    else:
-                        # Add to existing vector store
-                        vector_store.add_documents(texts)
-                    
-                    # Add to processed documents
-                    processed_docs = session_data.get("processed_documents", [])
-                    processed_docs.append(url)
-                    session_data["processed_documents"] = processed_docs
-        
-        # Rewrite the query for better retrieval
-        query_rewriter = get_query_rewriter_agent()
-        rewritten_query = query_rewriter.run(prompt).content
-        
-        # Save for display
-        session_data["rewritten_query"] = {
-            "original": prompt,
-            "rewritten": rewritten_query
+    # Load or initialize session data
+    session_data = None
+    if session_id:
+        session_data, _ = await asyncio.to_thread(load_session, session_id)
+    
+    if not session_data:
+        session_data = {
+            "session_id": session_id,
+            "session_name": "Untitled Session",
+            "history": [],
+            "processed_documents": [],
+            "info_messages": [],
+            "rewritten_query": {"original": "", "rewritten": ""},
+            "search_sources": [],
+            "doc_sources": [],
+            "use_web_search": True
         }
+    
+    # Add user message to history
+    history = session_data.get("history", [])
+    history.append({"role": "user", "content": prompt})
+    session_data["history"] = history
+    
+    turn = {
+        "session_id": session_id,
+        "session_data": session_data,
+        "prompt": prompt,
+        "full_prompt": None,
+        "sources": [],
+        "source_docs": [],
+        "query_embedding": None,
+        "use_web_search": True,
+        "cached_response": None
+    }
+    
+    # Check for URLs in prompt
+    detected_urls = detect_urls(prompt)
+    
+    # Process any detected URLs
+    ingested_urls = []
+    known_documents = set(session_data.get("processed_documents") or [])
+    new_urls = [url for url in detected_urls if url not in known_documents]
+    if new_urls and app_state["pinecone_client"]:
+        # Fetch all URLs concurrently, then embed and upsert their chunks in one batch
+        results = await asyncio.gather(*(asyncio.to_thread(process_web, url) for url in new_urls))
+        all_texts = []
+        for url, texts in zip(new_urls, results):
+            if texts:
+                all_texts.extend(texts)
+                ingested_urls.append(url)
         
-        # Choose search strategy
-        context = ""
-        search_links = []
-        source_docs = []
-        
-        # Get vector store for session
-        vector_store = get_session_vector_store(session_id)
-        
-        # First, try document search if not forcing web search
-        if not force_web_search and vector_store:
-            # Try document search first
-            has_relevant_docs, docs = check_document_relevance(
-                rewritten_query,
-                vector_store,
-                SIMILARITY_THRESHOLD,
-                namespace=session_id
+        if all_texts:
+            await ingest_texts(session_id, all_texts, ingested_urls, session_data=session_data)
+            # Record the ingested URLs now; a follow-up message must not ingest them again
+            # before the turn is saved in the background
+            await asyncio.to_thread(save_session, session_id, session_data, include_history=False)
+    
+    # Rewrite the query for better retrieval (memoized per prompt)
+    rewritten_query = await asyncio.to_thread(rewrite_query, prompt)
+    
+    # Save for display
+    session_data["rewritten_query"] = {
+        "original": prompt,
+        "rewritten": rewritten_query
+    }
+    
+    # Serve near-duplicate queries from the semantic cache
+    query_embedding = None
+    use_web_search = session_data.get("use_web_search", True)
+    turn["use_web_search"] = use_web_search
+    if not force_web_search and not ingested_urls:
+        def embed_and_lookup():
+            # The cache scan holds a lock shared with worker threads, so keep it off the event loop
+            embedding = app_state["embedder"].embed_query(rewritten_query)
+            return embedding, app_state["semantic_cache"].lookup(
+                embedding, scope=session_id, use_web_search=use_web_search
             )
-            
-            if docs:
-                context = "\n\n".join([d.page_content for d in docs])
-                source_docs = docs
-                
-                # Track documents used
-                doc_sources = []
-                for doc in docs:
-                    source_type = doc.metadata.get("source_type", "unknown")
-                    source_name = doc.metadata.get("file_name", "unknown")
-                    doc_sources.append({
-                        "source_type": source_type,
-                        "source_name": source_name,
-                        "url": doc.metadata.get("url", ""),
-                        "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-                    })
-                session_data["doc_sources"] = doc_sources
         
-        # Check if we should use web search
-        use_web_search = session_data.get("use_web_search", True)
-        search_intent_detected = False
-        
-        # Check if query needs web search based on intent detection
         try:
-            search_intent_detected = detect_google_search_intent(rewritten_query)
+            query_embedding, cached_response = await asyncio.to_thread(embed_and_lookup)
         except Exception as e:
-            # Fall back to regular behavior if intent detection fails
-            pass
-            
-        # Use Google search if applicable
-        should_use_web_search = (
-            force_web_search or 
-            (not source_docs and use_web_search and search_intent_detected) or
-            (use_web_search and search_intent_detected)
-        )
+            print(f"Semantic cache lookup failed: {e}")
+            cached_response = None
         
-        if should_use_web_search:
-            search_results, search_links = google_search(rewritten_query)
-            if search_results:
-                if context:
-                    context = f"{context}\n\n--- Additional Information from Google Search ---\n\n{search_results}"
-                else:
-                    context = f"Google Search Results:\n{search_results}"
-                
-                session_data["search_sources"] = search_links
-        
-        # Generate response using the RAG agent
-        rag_agent = get_rag_agent()
+        turn["query_embedding"] = query_embedding
+        if cached_response:
+            turn["cached_response"] = cached_response
+            turn["sources"] = cached_response["sources"]
+            return turn
+    
+    # Choose search strategy
+    context = ""
+    search_links = []
+    source_docs = []
+    sources = []
+    
+    # Get vector store for session
+    vector_store = get_session_vector_store(session_id)
+    
+    async def search_documents():
+        _, scored_docs = await asyncio.to_thread(
+            check_document_relevance,
+            rewritten_query,
+            vector_store,
+            SIMILARITY_THRESHOLD,
+            namespace=session_id,
+            query_embedding=query_embedding,
+            local_cache=app_state["vector_cache"],
+            with_scores=True
+        )
+        return scored_docs
+    
+    async def search_web():
+        if not force_web_search:
+            # Check if query needs web search based on intent detection
+            try:
+                search_intent_detected = await asyncio.to_thread(detect_google_search_intent, rewritten_query)
+            except Exception as e:
+                # Fall back to regular behavior if intent detection fails
+                search_intent_detected = False
+            if not search_intent_detected:
+                return None
+        return await asyncio.to_thread(google_search, rewritten_query)
+    
+    # Run document search alongside intent detection and Google search
+    web_task = asyncio.create_task(search_web()) if force_web_search or use_web_search else None
+    scored_docs = []
+    try:
+        if not force_web_search and vector_store:
+            scored_docs = await search_documents()
+    except BaseException:
+        if web_task:
+            web_task.cancel()
+        raise
+    
+    # Documents that answer the query confidently make the web results redundant
+    drop_web = bool(
+        web_task and not force_web_search and scored_docs
+        and max(relevance for _, relevance in scored_docs) >= HIGH_CONFIDENCE_THRESHOLD
+    )
+    if drop_web:
+        # May already have finished; its results are skipped either way
+        web_task.cancel()
+    
+    docs = [doc for doc, _ in scored_docs]
+    if docs:
+        context = "\n\n".join([d.page_content for d in docs])
+        source_docs = docs
         
-        if context:
-            full_prompt = f"""Context: {context}
-
-Original Question: {prompt}
-Rewritten Question: {rewritten_query}
-
-"""
-            if search_links:
-                full_prompt += f"Source Links:\n" + "\n".join([f"- {link}" for link in search_links]) + "\n\n"
+        # Track documents used, building session and response sources in one pass
+        doc_sources = []
+        for doc in docs:
+            source_type = doc.metadata.get("source_type", "unknown")
+            source_name = doc.metadata.get("file_name", "unknown")
+            url = doc.metadata.get("url", "")
+            content = doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
+            doc_sources.append({
+                "source_type": source_type,
+                "source_name": source_name,
+                "url": url,
+                "content": content
+            })
+            sources.append({
+                "type": source_type,
+                "name": source_name,
+                "content": content,
+                "url": url
+            })
+        session_data["doc_sources"] = doc_sources
+    
+    # Use Google search results if applicable
+    web_results = None
+    if web_task and not drop_web:
+        web_results = await web_task
+    elif drop_web and web_task.done() and not web_task.cancelled():
+        # Retrieve the discarded outcome so a failed search is not reported as unhandled
+        web_task.exception()
+    
+    if web_results:
+        search_results, search_links = web_results
+        if search_results:
+            if context:
+                context = f"{context}\n\n--- Additional Information from Google Search ---\n\n{search_results}"
+            else:
+                context = f"Google Search Results:\n{search_results}"
             
-            full_prompt += "Please provide a comprehensive answer based on the available information."
-        else:
-            full_prompt = f"Original Question: {prompt}\nRewritten Question: {rewritten_query}"
-            session_data["info_messages"] = ["No relevant information found in documents or Google search."]
+            session_data["search_sources"] = search_links
+    
+    # Build the prompt for the RAG agent
+    if context:
+        parts = [PROMPT_TEMPLATE.format(context=context, prompt=prompt, rewritten=rewritten_query)]
+        if search_links:
+            parts.append(LINK_HEADER)
+            parts.append("\n".join(f"- {link}" for link in search_links))
+            parts.append("\n\n")
+        parts.append(ANSWER_INSTRUCTION)
+        full_prompt = "".join(parts)
+    else:
+        full_prompt = f"Original Question: {prompt}\nRewritten Question: {rewritten_query}"
+        session_data["info_messages"] = ["No relevant information found in documents or Google search."]
+    
+    # Add search sources
+    if search_links:
+        for link in search_links:
+            sources.append({
+                "type": "web",
+                "name": link,
+                "url": link,
+                "content": ""
+            })
+    
+    turn["full_prompt"] = full_prompt
+    turn["sources"] = sources
+    turn["source_docs"] = source_docs
+    return turn
 
-        response = rag_agent.run(full_prompt)
-        
-        # Add assistant response to history
-        history.append({"role": "assistant", "content": response.content})
-        session_data["history"] = history
-        
-        # Generate and save session title if not set
-        if session_data.get("session_name") == "Untitled Session":
-            session_data["session_name"] = generate_session_title(prompt)
-        
-        # Save session data
+def finalize_chat(turn: Dict[str, Any], content: str):
+    """Record the assistant reply, cache it and persist the session"""
+    session_id = turn["session_id"]
+    session_data = turn["session_data"]
+    
+    # Add assistant response to history
+    history = session_data.get("history", [])
+    history.append({"role": "assistant", "content": content})
+    session_data["history"] = history
+    
+    # Generate and save session title if not set
+    if session_data.get("session_name") == "Untitled Session":
+        session_data["session_name"] = generate_session_title(turn["prompt"])
+    
+    if not detect_message_log():
+        # Without the messages table the whole history lives on the session row
         save_session(session_id, session_data)
+    else:
+        # Save session metadata, then append only this turn's messages
+        save_session(session_id, session_data, include_history=False)
+        success, error = append_turn(session_id, [
+            {"role": "user", "content": turn["prompt"]},
+            {"role": "assistant", "content": content}
+        ])
+        if not success:
+            print(f"Appending turn failed, saving full history: {error}")
+            save_session(session_id, session_data)
+    
+    # Cache the response for this session and its web search setting only
+    if turn["query_embedding"] is not None and not turn["cached_response"]:
+        app_state["semantic_cache"].add(
+            turn["query_embedding"],
+            {"content": content, "sources": turn["sources"]},
+            scope=session_id,
+            use_web_search=turn["use_web_search"]
+        )
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """Format a payload as a server-sent event frame"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+@app.post(
+    "/chat",
+    response_model=MessageResponse,
+    dependencies=[Depends(get_api_key)],
+    openapi_extra=body_schema(MessageRequest)
+)
+async def chat(http_request: Request, background_tasks: BackgroundTasks):
+    """
+    Process a chat message and return response
+    
+    This endpoint handles:
+    1. Query rewriting automatically
+    2. Web search when force_web_search=true or when appropriate
+    3. Document retrieval from vector store
+    4. Response generation with all available context
+    """
+    request = await decode_body(http_request, MessageRequest)
+    
+    # Process and respond to the message
+    try:
+        turn = await prepare_chat(request)
         
-        # Prepare sources for response
-        sources = []
-        
-        # Add document sources
-        if source_docs:
-            for doc in source_docs:
-                source_type = doc.metadata.get("source_type", "unknown")
-                source_name = doc.metadata.get("file_name", "unknown")
-                sources.append({
-                    "type": source_type,
-                    "name": source_name,
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "url": doc.metadata.get("url", "")
-                })
+        if turn["cached_response"]:
+            content = turn["cached_response"]["content"]
+        else:
+            # Generate response using the RAG agent
+            rag_agent = get_rag_agent()
+            response = await asyncio.to_thread(rag_agent.run, turn["full_prompt"])
+            content = response.content
         
-        # Add search sources
-        if search_links:
-            for link in search_links:
-                sources.append({
-                    "type": "web",
-                    "name": link,
-                    "url": link,
-                    "content": ""
-                })
+        # Persist after the response has been sent
+        background_tasks.add_task(finalize_chat, turn, content)
         
-        return {"content": response.content, "sources": sources, "session_id": session_id}
+        return ORJSONResponse({"content": content, "sources": turn["sources"], "session_id": turn["session_id"]})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
+@app.post("/chat/stream", dependencies=[Depends(get_api_key)], openapi_extra=body_schema(MessageRequest))
+async def chat_stream(http_request: Request, background_tasks: BackgroundTasks):
+    """
+    Process a chat message and stream the response as server-sent events
+    
+    Emits "token" events as the RAG agent generates text, then a "done" event
+    with the sources and session ID. The session is saved once the stream
+    has completed.
+    """
+    request = await decode_body(http_request, MessageRequest)
+    try:
+        turn = await prepare_chat(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+    
+    parts = []
+    state = {"completed": False}
+    
+    async def event_stream():
+        try:
+            if turn["cached_response"]:
+                parts.append(turn["cached_response"]["content"])
+                yield sse_event({"type": "token", "content": parts[0]})
+            else:
+                rag_agent = get_rag_agent()
+                chunks = await asyncio.to_thread(rag_agent.run, turn["full_prompt"], stream=True)
+                # Pull each chunk in a worker thread so generation never blocks the event loop
+                while True:
+                    chunk = await asyncio.to_thread(next, chunks, None)
+                    if chunk is None:
+                        break
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield sse_event({"type": "token", "content": chunk.content})
+            
+            state["completed"] = True
+            yield sse_event({"type": "done", "sources": turn["sources"], "session_id": turn["session_id"]})
+        except Exception as e:
+            yield sse_event({"type": "error", "detail": f"Error processing message: {str(e)}"})
+    
+    def save_streamed_turn():
+        # Partial answers from failed streams are not persisted
+        if state["completed"]:
+            finalize_chat(turn, "".join(parts))
+    
+    background_tasks.add_task(save_streamed_turn)
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # CURRICULUM API ENDPOINTS - PLURAL FORM (RECOMMENDED)
 @app.get("/curriculums", response_model=CurriculumListResponse, dependencies=[Depends(get_api_key)])
 async def list_curriculums():
@@ -1,3 +1,12 @@
+import re
+from typing import List
+
+# http(s) and bare www. URLs, up to whitespace or characters that cannot appear unquoted in a URL.
+# www. must not follow "@", a word character or "." so e-mail addresses are not matched.
+URL_PATTERN = re.compile(r"(?:\bhttps?://|(?<![@\w.])www\.)[^\s<>\"'`]+", re.IGNORECASE)
+TRAILING_PUNCTUATION = ".,;:!?"
+CLOSING_BRACKETS = {")": "(", "]": "[", "}": "{"}
+
 def format_url_display(url, max_length=50):
     """Format URL for display by shortening if needed."""
     if len(url) > max_length:
@@ -5,3 +14,35 @@ def format_url_display(url, max_length=50):
         domain = url.split('//')[-1].split('/')[0]
         return f"{domain}/...{url[-20:]}"
     return url
+
+def strip_trailing_punctuation(url: str) -> str:
+    """
+    Remove sentence punctuation after a URL.
+    
+    Closing brackets are only removed when unbalanced, so "(see https://x.org/a)"
+    loses its ")" while "https://en.wikipedia.org/wiki/Foo_(bar)" keeps it.
+    """
+    while url:
+        last = url[-1]
+        if last in TRAILING_PUNCTUATION:
+            url = url[:-1]
+        elif last in CLOSING_BRACKETS and url.count(last) > url.count(CLOSING_BRACKETS[last]):
+            url = url[:-1]
+        else:
+            break
+    return url
+
+def detect_urls(text: str) -> List[str]:
+    """
+    Extract all URLs from free text, in order of appearance and without duplicates.
+    
+    Bare www. addresses are returned with an https:// scheme so they can be loaded directly.
+    """
+    urls = []
+    for match in URL_PATTERN.finditer(text):
+        url = strip_trailing_punctuation(match.group(0))
+        if url.lower().startswith("www."):
+            url = f"https://{url}"
+        if url not in urls:
+            urls.append(url)
+    return urls
@@ -0,0 +1,133 @@
+import threading
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from embedder import EMBEDDING_DIMENSION, normalize_embedding, cosine_similarities
+
+# Scope key of empty or invalidated slots; real scopes never hash to it
+EMPTY_SCOPE = 0
+
+
+class SemanticCache:
+    """
+    In-process cache of chat responses keyed on rewritten query embeddings.
+
+    A lookup returns the stored response of the most similar previous query
+    when its cosine similarity exceeds the threshold. Every entry belongs to
+    one session and records whether web search was enabled when it was
+    answered, since the session's documents and web setting both decide what
+    the right answer is. Once max_entries is reached the least recently used
+    entry is overwritten.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 10000, dimension: int = EMBEDDING_DIMENSION):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vecs = np.zeros((0, dimension), dtype=np.float32)
+        self.last_used = np.zeros(0, dtype=np.int64)
+        self.scope_keys = np.zeros(0, dtype=np.int64)
+        self.web_flags = np.zeros(0, dtype=bool)
+        self.scopes = []
+        self.responses = []
+        self.size = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _scope_key(scope: str) -> int:
+        return hash(scope) or 1
+
+    def _grow(self):
+        """Double the backing arrays, up to max_entries rows"""
+        capacity = min(self.max_entries, max(16, len(self.vecs) * 2))
+        vecs = np.zeros((capacity, self.vecs.shape[1]), dtype=np.float32)
+        vecs[:self.size] = self.vecs[:self.size]
+        last_used = np.zeros(capacity, dtype=np.int64)
+        last_used[:self.size] = self.last_used[:self.size]
+        scope_keys = np.zeros(capacity, dtype=np.int64)
+        scope_keys[:self.size] = self.scope_keys[:self.size]
+        web_flags = np.zeros(capacity, dtype=bool)
+        web_flags[:self.size] = self.web_flags[:self.size]
+        self.vecs, self.last_used, self.scope_keys, self.web_flags = vecs, last_used, scope_keys, web_flags
+        self.scopes.extend([None] * (capacity - len(self.scopes)))
+        self.responses.extend([None] * (capacity - len(self.responses)))
+
+    def lookup(self, embedding, scope: str, use_web_search: bool) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached response for a query embedding
+
+        Args:
+            embedding: Embedding of the rewritten query
+            scope: Session ID the response must belong to
+            use_web_search: Whether the session currently allows web search
+
+        Returns:
+            Optional[Dict]: The cached response, or None on a miss
+        """
+        query = normalize_embedding(embedding)
+        with self.lock:
+            if self.size:
+                allowed = (self.scope_keys[:self.size] == self._scope_key(scope)) & (self.web_flags[:self.size] == use_web_search)
+                rows = np.flatnonzero(allowed)
+                if len(rows):
+                    # Only the session's own entries are scored
+                    scores = cosine_similarities(query, self.vecs[rows])
+                    best = int(np.argmax(scores))
+                    slot = int(rows[best])
+                    if scores[best] > self.threshold and self.scopes[slot] == scope:
+                        self.clock += 1
+                        self.last_used[slot] = self.clock
+                        self.hits += 1
+                        return self.responses[slot]
+            self.misses += 1
+            return None
+
+    def add(self, embedding, response: Dict[str, Any], scope: str, use_web_search: bool):
+        """Store a session's response under the given query embedding"""
+        query = normalize_embedding(embedding)
+        with self.lock:
+            if self.size == len(self.vecs) and self.size < self.max_entries:
+                self._grow()
+            if self.size < len(self.vecs):
+                slot = self.size
+                self.size += 1
+            else:
+                slot = int(np.argmin(self.last_used[:self.size]))
+            self.clock += 1
+            self.vecs[slot] = query
+            self.last_used[slot] = self.clock
+            self.scope_keys[slot] = self._scope_key(scope)
+            self.web_flags[slot] = use_web_search
+            self.scopes[slot] = scope
+            self.responses[slot] = response
+
+    def invalidate(self, scope: str):
+        """Drop every entry of a session, e.g. after new documents were added"""
+        with self.lock:
+            stale = self.scope_keys[:self.size] == self._scope_key(scope)
+            # Zeroed vectors can never match and are reused first by add()
+            self.vecs[:self.size][stale] = 0.0
+            self.last_used[:self.size][stale] = -1
+            self.scope_keys[:self.size][stale] = EMPTY_SCOPE
+            for slot in np.flatnonzero(stale):
+                self.scopes[slot] = None
+                self.responses[slot] = None
+
+    def clear(self):
+        with self.lock:
+            self.size = 0
+            self.scopes = [None] * len(self.scopes)
+            self.responses = [None] * len(self.responses)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
@@ -16,6 +16,28 @@ logger = logging.getLogger(__name__)
 # Initialize Supabase client
 supabase_client = initialize_supabase()
 
+# Whether the messages table and sessions.history_message_id exist; detected once
+message_log_available = None
+
+def detect_message_log() -> bool:
+    """
+    Check once whether the database supports appended messages
+    
+    Requires the `messages` table and the `sessions.history_message_id`
+    column described in api_docs.md. Without them sessions keep their whole
+    history on the session row.
+    """
+    global message_log_available
+    if message_log_available is None:
+        try:
+            supabase_client.table('messages').select('id').limit(1).execute()
+            supabase_client.table('sessions').select('history_message_id').limit(1).execute()
+            message_log_available = True
+        except Exception as e:
+            logger.info(f"Appended messages disabled, storing full history on sessions: {e}")
+            message_log_available = False
+    return message_log_available
+
 def convert_uuid_to_str(obj):
     """
     Recursively convert UUID objects to strings for JSON serialization
@@ -47,7 +69,9 @@ def delete_session(session_id: str) -> Tuple[bool, str]:
         Tuple[bool, str]: (success, error_message)
     """
     try:
-        # Delete the session from Supabase
+        # Delete the session and its appended messages from Supabase
+        if detect_message_log():
+            supabase_client.table('messages').delete().eq('session_id', session_id).execute()
         supabase_client.table('sessions').delete().eq('session_id', session_id).execute()
         return True, ""
     except Exception as e:
@@ -55,10 +79,22 @@ def delete_session(session_id: str) -> Tuple[bool, str]:
         error_message = f"Error deleting session: {str(e)}"
         return False, error_message
 
-def save_session(session_id: str, session_data: Dict[str, Any]) -> Tuple[bool, str]:
+def save_session(session_id: str, session_data: Dict[str, Any], include_history: bool = True) -> Tuple[bool, str]:
     """
     Save session data to Supabase
     
+    Args:
+        session_id: The ID of the session to save
+        session_data: The session fields to store
+        include_history: Rewrite the stored history with session_data["history"].
+            When False only metadata is written and new messages are expected
+            to go through append_turn.
+    
+    A full save records in history_message_id the last appended message the
+    history already contains, so load_session never merges a message twice
+    and messages appended after the session was loaded are kept. Merged
+    messages are deleted afterwards only to reclaim space.
+    
     Returns:
         Tuple[bool, str]: (success, error_message)
     """
@@ -82,9 +118,8 @@ def save_session(session_id: str, session_data: Dict[str, Any]) -> Tuple[bool, s
         
         if len(response.data) > 0:
             # Update existing session
-            supabase_client.table('sessions').update({
+            update = {
                 'session_name': serializable_data.get('session_name', 'Untitled Session'),
-                'history': serializable_data['history'],
                 'processed_documents': serializable_data['processed_documents'],
                 'info_messages': serializable_data['info_messages'],
                 'rewritten_query': serializable_data['rewritten_query'],
@@ -92,13 +127,30 @@ def save_session(session_id: str, session_data: Dict[str, Any]) -> Tuple[bool, s
                 'doc_sources': serializable_data['doc_sources'],
                 'use_web_search': serializable_data['use_web_search'],
                 'updated_at': 'now()'
-            }).eq('session_id', db_session_id).execute()
+            }
+            merged_through = None
+            if include_history:
+                update['history'] = serializable_data['history']
+                if detect_message_log():
+                    merged_through = serializable_data.get('history_message_id')
+                    if merged_through is None:
+                        # History not built by load_session; it covers what is stored right now
+                        merged_through = last_message_id(db_session_id)
+                    update['history_message_id'] = merged_through
+            # History and the merge marker change together in one row update
+            supabase_client.table('sessions').update(update).eq('session_id', db_session_id).execute()
+            if merged_through is not None:
+                try:
+                    supabase_client.table('messages').delete().eq('session_id', db_session_id).lte('id', merged_through).execute()
+                except Exception as e:
+                    # Harmless: load_session skips messages up to history_message_id
+                    logger.warning(f"Could not delete merged messages: {e}")
         else:
             # Insert new session
             supabase_client.table('sessions').insert({
                 'session_id': db_session_id,
                 'session_name': serializable_data.get('session_name', 'Untitled Session'),
-                'history': serializable_data['history'],
+                'history': serializable_data['history'] if include_history else [],
                 'processed_documents': serializable_data['processed_documents'],
                 'info_messages': serializable_data['info_messages'],
                 'rewritten_query': serializable_data['rewritten_query'],
@@ -116,6 +168,10 @@ def load_session(session_id: str) -> Tuple[Optional[Dict[str, Any]], str]:
     """
     Load session data from Supabase
     
+    The returned history is the history stored on the session row followed
+    by the messages added with append_turn that it does not contain yet.
+    history_message_id is set to the last of those messages.
+    
     Returns:
         Tuple[Optional[Dict], str]: (session_data, error_message)
     """
@@ -123,13 +179,61 @@ def load_session(session_id: str) -> Tuple[Optional[Dict[str, Any]], str]:
         response = supabase_client.table('sessions').select('*').eq('session_id', session_id).execute()
         
         if len(response.data) > 0:
-            return response.data[0], ""
+            session_data = response.data[0]
+            if detect_message_log():
+                query = supabase_client.table('messages').select('id, role, content').eq('session_id', session_id)
+                if session_data.get('history_message_id') is not None:
+                    query = query.gt('id', session_data['history_message_id'])
+                messages = query.order('id').execute().data
+                session_data['history'] = (session_data.get('history') or []) + [
+                    {'role': message['role'], 'content': message['content']} for message in messages
+                ]
+                # 0 marks a history that contains no appended messages
+                session_data['history_message_id'] = messages[-1]['id'] if messages else (session_data.get('history_message_id') or 0)
+            return session_data, ""
         return None, "Session not found"
     except Exception as e:
         error_details = traceback.format_exc()
         error_message = f"Error loading session: {str(e)}"
         return None, error_message
 
+def append_turn(session_id: str, messages: List[Dict[str, str]]) -> Tuple[bool, str]:
+    """
+    Append chat messages to a session without rewriting its history
+    
+    Each message becomes a row of the `messages` table (schema in
+    api_docs.md), so the cost of saving a turn does not grow with the
+    conversation. Fails when the table is not available, in which case the
+    caller should save the full history instead.
+    
+    Args:
+        session_id: The ID of an existing session
+        messages: Messages with "role" and "content" keys, in order
+        
+    Returns:
+        Tuple[bool, str]: (success, error_message)
+    """
+    try:
+        if not messages:
+            return True, ""
+        if not detect_message_log():
+            return False, "Appended messages are not available"
+        rows = [
+            {'session_id': str(session_id), 'role': message['role'], 'content': message['content']}
+            for message in messages
+        ]
+        supabase_client.table('messages').insert(rows).execute()
+        return True, ""
+    except Exception as e:
+        error_details = traceback.format_exc()
+        error_message = f"Error appending messages: {str(e)}"
+        return False, error_message
+
+def last_message_id(session_id: str) -> Optional[int]:
+    """Return the ID of the newest appended message of a session, if any"""
+    response = supabase_client.table('messages').select('id').eq('session_id', session_id).order('id', desc=True).limit(1).execute()
+    return response.data[0]['id'] if response.data else None
+
 def get_available_sessions() -> Tuple[List[Dict[str, Any]], str]:
     """
     Get list of available saved sessions from Supabase
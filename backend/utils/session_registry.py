@@ -0,0 +1,103 @@
+import time
+import threading
+from typing import Dict, Any, List
+
+import numpy as np
+
+
+class SessionStoreRegistry:
+    """
+    Vector store bindings of active sessions, laid out as parallel arrays.
+
+    Session IDs, vector stores and last access times are kept in parallel
+    arrays indexed by row, so LRU eviction is a single vectorized selection
+    instead of a walk over a dict of objects. Removed rows are filled by
+    swapping in the last row. `version` changes whenever a session is added
+    or removed.
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.vs_objects: List[Any] = []
+        self.rows: Dict[str, int] = {}
+        self.last_used = np.zeros(0, dtype=np.float64)
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.rows
+
+    def _ensure_capacity(self, size: int):
+        if size <= len(self.last_used):
+            return
+        capacity = max(16, len(self.last_used) * 2)
+        last_used = np.zeros(capacity, dtype=np.float64)
+        last_used[:len(self.ids)] = self.last_used[:len(self.ids)]
+        self.last_used = last_used
+
+    def get(self, session_id: str):
+        """Return the session's vector store and mark it as recently used"""
+        with self.lock:
+            row = self.rows.get(session_id)
+            if row is None:
+                return None
+            self.last_used[row] = time.time()
+            return self.vs_objects[row]
+
+    def put(self, session_id: str, vector_store):
+        with self.lock:
+            row = self.rows.get(session_id)
+            if row is None:
+                row = len(self.ids)
+                self._ensure_capacity(row + 1)
+                self.ids.append(session_id)
+                self.vs_objects.append(vector_store)
+                self.rows[session_id] = row
+                self.version += 1
+            else:
+                self.vs_objects[row] = vector_store
+            self.last_used[row] = time.time()
+
+    def _remove_row(self, row: int):
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.vs_objects[row] = self.vs_objects[last]
+            self.last_used[row] = self.last_used[last]
+            self.rows[moved] = row
+        self.ids.pop()
+        self.vs_objects.pop()
+        self.version += 1
+
+    def remove(self, session_id: str) -> bool:
+        with self.lock:
+            row = self.rows.pop(session_id, None)
+            if row is None:
+                return False
+            self._remove_row(row)
+            return True
+
+    def evict_least_recently_used(self, count: int) -> List[str]:
+        """Remove the `count` least recently used sessions and return their IDs"""
+        with self.lock:
+            size = len(self.ids)
+            count = min(count, size)
+            if count <= 0:
+                return []
+            # O(N) selection of the oldest rows; order among them does not matter
+            oldest = np.argpartition(self.last_used[:size], count - 1)[:count]
+            evicted = [self.ids[row] for row in oldest]
+            for session_id in evicted:
+                self._remove_row(self.rows.pop(session_id))
+            return evicted
+
+    def clear(self):
+        with self.lock:
+            self.ids = []
+            self.vs_objects = []
+            self.rows = {}
+            self.version += 1
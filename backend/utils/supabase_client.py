@@ -28,12 +28,20 @@ def get_supabase_client() -> Tuple[Optional[Client], str]:
         error_details = traceback.format_exc()
         return None, f"Error creating Supabase client: {str(e)}"
 
+# Shared client reused by every caller in the process
+_shared_client: Optional[Client] = None
+
 def initialize_supabase():
-    """Initialize Supabase and return client"""
+    """Initialize Supabase once and return the shared client"""
+    global _shared_client
+    if _shared_client is not None:
+        return _shared_client
+    
     try:
         client, error = get_supabase_client()
         if error:
             print(f"Supabase initialization warning: {error}")
+        _shared_client = client
         return client
     except Exception as e:
         print(f"Error initializing Supabase: {e}")
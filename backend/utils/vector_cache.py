@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from embedder import EMBEDDING_DIMENSION, quantize_embedding, cosine_similarities
+
+# Parent directory of the per-process directories holding one int8 memmap file per namespace
+VECTOR_CACHE_DIR = os.getenv("VECTOR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "teacher_assistant_vectors"))
+
+
+class LocalVectorCache:
+    """
+    Per-namespace copy of the document embeddings upserted by this process.
+
+    Vectors are quantized to int8 at insert time and appended to an on-disk
+    np.memmap per namespace, so relevance checks can be scored locally with
+    SIMD cosine kernels instead of a Pinecone round-trip at a quarter of the
+    float32 memory traffic. A namespace is only served locally while the copy
+    is complete, i.e. the namespace was empty in Pinecone when this process
+    started tracking it.
+
+    Completeness only covers this process's own writes, so the cache must
+    only be enabled when a single worker serves all sessions. Each instance
+    keeps its files in its own directory and never touches another
+    process's files.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION, cache_dir: str = VECTOR_CACHE_DIR, enabled: bool = True):
+        self.dimension = dimension
+        self.parent_dir = cache_dir
+        self.cache_dir = None
+        self.enabled = enabled
+        self.namespaces: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def _allocate_path(self) -> str:
+        if self.cache_dir is None:
+            os.makedirs(self.parent_dir, exist_ok=True)
+            self.cache_dir = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=self.parent_dir)
+        fd, path = tempfile.mkstemp(suffix=".i8", dir=self.cache_dir)
+        os.close(fd)
+        return path
+
+    def _grow(self, entry: Dict[str, Any], required: int):
+        """Reallocate a namespace memmap with room for at least `required` rows"""
+        capacity = max(64, len(entry["vecs"]) if entry["vecs"] is not None else 0)
+        while capacity < required:
+            capacity *= 2
+        if entry["vecs"] is not None:
+            entry["vecs"].flush()
+        if entry["path"] is None:
+            entry["path"] = self._allocate_path()
+        # Extend the file in place before mapping the larger shape
+        with open(entry["path"], "r+b") as f:
+            f.truncate(capacity * self.dimension)
+        entry["vecs"] = np.memmap(entry["path"], dtype=np.int8, mode="r+", shape=(capacity, self.dimension))
+
+    def is_known(self, namespace: str) -> bool:
+        with self.lock:
+            return namespace in self.namespaces
+
+    def is_complete(self, namespace: str) -> bool:
+        with self.lock:
+            entry = self.namespaces.get(namespace)
+            return bool(entry and entry["complete"])
+
+    def start_tracking(self, namespace: str, complete: bool):
+        """Begin mirroring a namespace; incomplete namespaces keep using Pinecone"""
+        with self.lock:
+            if not self.enabled or namespace in self.namespaces:
+                return
+            self.namespaces[namespace] = {
+                "complete": complete,
+                "path": None,
+                "vecs": None,
+                "size": 0,
+                "docs": []
+            }
+
+    def mark_incomplete(self, namespace: str):
+        """Stop serving a namespace locally, e.g. after a failed upsert left Pinecone ahead of the copy"""
+        with self.lock:
+            entry = self.namespaces.get(namespace)
+            if entry is not None:
+                entry["complete"] = False
+                self._release(entry)
+
+    def add(self, namespace: str, embeddings: List[List[float]], documents: List[Document]):
+        """Quantize and append upserted embeddings and their documents to a tracked namespace"""
+        if not documents:
+            return
+        vecs = quantize_embedding(embeddings)
+        with self.lock:
+            entry = self.namespaces.get(namespace)
+            if entry is None or not entry["complete"]:
+                return
+            start = entry["size"]
+            end = start + len(vecs)
+            if entry["vecs"] is None or end > len(entry["vecs"]):
+                self._grow(entry, end)
+            entry["vecs"][start:end] = vecs
+            entry["docs"].extend(documents)
+            entry["size"] = end
+
+    def search(self, namespace: str, query_embedding, k: int = 5, threshold: float = 0.7, with_scores: bool = False) -> Optional[List[Any]]:
+        """
+        Return the k most similar documents whose relevance reaches the threshold
+
+        Relevance uses the same [0, 1] scale langchain applies to Pinecone
+        cosine scores, so thresholds behave identically on both paths.
+
+        Returns:
+            Optional[List]: Matching documents, or (document, relevance) pairs when
+                with_scores is set; None if the namespace is not served locally
+        """
+        query = quantize_embedding(query_embedding)
+        with self.lock:
+            entry = self.namespaces.get(namespace)
+            if entry is None or not entry["complete"]:
+                return None
+            if not entry["size"]:
+                return []
+            relevance = (cosine_similarities(query, entry["vecs"][:entry["size"]]) + 1) / 2
+            docs = entry["docs"]
+
+        candidates = np.flatnonzero(relevance >= threshold)
+        top = candidates[np.argsort(-relevance[candidates])[:k]]
+        if with_scores:
+            return [(docs[i], float(relevance[i])) for i in top]
+        return [docs[i] for i in top]
+
+    def drop(self, namespace: str):
+        with self.lock:
+            entry = self.namespaces.pop(namespace, None)
+            if entry is not None:
+                self._release(entry)
+
+    def clear(self):
+        with self.lock:
+            for entry in self.namespaces.values():
+                self._release(entry)
+            self.namespaces = {}
+            if self.cache_dir is not None:
+                shutil.rmtree(self.cache_dir, ignore_errors=True)
+                self.cache_dir = None
+
+    @staticmethod
+    def _release(entry: Dict[str, Any]):
+        entry["vecs"] = None
+        entry["docs"] = []
+        entry["size"] = 0
+        if entry["path"] is not None and os.path.exists(entry["path"]):
+            os.unlink(entry["path"])
+        entry["path"] = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "namespaces": len(self.namespaces),
+                "complete_namespaces": sum(1 for entry in self.namespaces.values() if entry["complete"]),
+                "vectors": sum(entry["size"] for entry in self.namespaces.values()),
+                "dtype": "int8"
+            }